@@ -0,0 +1,2 @@
+#!/bin/bash
+python src/pipeline.py -d data -w working -f plots/frames -o output -c cache -j 14 "$@"
@@ -0,0 +1,224 @@
+"""
+Renders many plots from a JSON spec file while reading each input only once.
+
+Example spec:
+
+    {
+        "defaults": {"title": "Tropical SST"},
+        "plots": [
+            {"kind": "stats", "infile": "stats.csv", "outfile": "a.png"},
+            {
+                "kind": "mean",
+                "infile": "sst-mean.nc",
+                "outfile": "b.png",
+                "window": 2920,
+                "label": "1 Year Mean",
+                "start": "1990-01-01",
+                "end": "2000-01-01"
+            }
+        ]
+    }
+
+`kind` is "stats" for mean_plot.py style plots and "mean" for
+bounded_mean_plot.py style plots. Any other key is one of that script's
+command line options, by its long name. `start` and `end` optionally limit
+the plotted date range (end exclusive).
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import traceback
+
+import bounded_mean_plot
+import mean_plot
+from util import init_plotting
+
+
+_KINDS = {"stats": mean_plot, "mean": bounded_mean_plot}
+_RANGE_KEYS = ["start", "end"]
+
+# Data sources for the current worker, keyed by (kind, infile)
+_CACHE = {}
+
+
+def _to_argv(parser, options):
+    """Turns spec options into command line arguments for `parser`."""
+    actions = {a.dest: a for a in parser._actions if a.option_strings}
+    argv = []
+    for k, v in options.items():
+        action = actions.get(k)
+        if action is None or k == "help":
+            raise ValueError(f"unknown option: {k}")
+        flag = max(action.option_strings, key=len)
+        if action.nargs == 0:
+            if v:
+                argv.append(flag)
+        else:
+            argv.append(f"{flag}={v}")
+    return argv
+
+
+def _parse_date(s):
+    """Parses an ISO date or datetime into naive UTC."""
+    if s is None:
+        return None
+    d = dt.datetime.fromisoformat(s)
+    if d.tzinfo is not None:
+        d = d.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return d
+
+
+def _parse_entry(entry):
+    kind = entry.get("kind")
+    if kind not in _KINDS:
+        raise ValueError(f"unknown kind: {kind}")
+    options = {
+        k: v for k, v in entry.items() if k != "kind" and k not in _RANGE_KEYS
+    }
+    parser = _KINDS[kind]._get_parser()
+    argv = _to_argv(parser, options)
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        # argparse has already printed the reason
+        raise ValueError(f"invalid options: {' '.join(argv)}")
+    if not args.infile:
+        raise ValueError("no infile given")
+    if not args.outfile:
+        raise ValueError("no outfile given")
+    args.show = False
+    return {
+        "kind": kind,
+        "args": args,
+        "infile": args.infile,
+        "outfile": args.outfile,
+        "start": _parse_date(entry.get("start")),
+        "end": _parse_date(entry.get("end")),
+    }
+
+
+def load_spec(path):
+    """Reads and validates a spec file.
+
+    Every entry goes through its plot script's own parser so that bad specs
+    fail here rather than in a worker.
+    """
+    with open(path) as fd:
+        spec = json.load(fd)
+    defaults = spec.get("defaults", {})
+    plots = []
+    for i, entry in enumerate(spec["plots"]):
+        try:
+            plots.append(_parse_entry({**defaults, **entry}))
+        except ValueError as e:
+            raise ValueError(f"Plot {i}: {e}")
+    return plots
+
+
+def _load_source(kind, infile):
+    print(f"Loading: {infile}")
+    if kind == "stats":
+        with open(infile) as fd:
+            return mean_plot.read_data(fd)
+    return bounded_mean_plot.read_data(infile)
+
+
+def load_sources(plots):
+    """Reads each distinct (kind, infile) pair once."""
+    cache = {}
+    for p in plots:
+        key = (p["kind"], p["infile"])
+        if key not in cache:
+            cache[key] = _load_source(*key)
+    return cache
+
+
+def _slice_dates(data, start, end):
+    times = data[0]
+    idx = [
+        i
+        for i, t in enumerate(times)
+        if (start is None or t >= start) and (end is None or t < end)
+    ]
+    return ([times[i] for i in idx], *[v[idx] for v in data[1:]])
+
+
+def _init_worker(cache):
+    import matplotlib
+
+    matplotlib.use("Agg")
+    _CACHE.update(cache)
+    init_plotting()
+
+
+def render(entry):
+    """Renders a single spec entry. Returns None or an error message."""
+    try:
+        args = entry["args"]
+        data = _CACHE[(entry["kind"], entry["infile"])]
+        start = entry["start"]
+        end = entry["end"]
+        if start is not None or end is not None:
+            data = _slice_dates(data, start, end)
+        outdir = os.path.dirname(os.path.abspath(args.outfile))
+        os.makedirs(outdir, exist_ok=True)
+        if entry["kind"] == "stats":
+            mean_plot.make_plot(data, args)
+        else:
+            bounded_mean_plot.plot(*data, args)
+    except Exception:
+        return traceback.format_exc()
+    print(f"Done: {entry['outfile']}")
+    return None
+
+
+def render_all(plots, njobs=1):
+    """Renders `plots` across a process pool. Returns the failed entries."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    cache = load_sources(plots)
+    print(f"Loaded {len(cache)} data sources for {len(plots)} plots")
+    failed = []
+    # The cache is sent once to each worker rather than once per plot
+    with ProcessPoolExecutor(
+        njobs, initializer=_init_worker, initargs=(cache,)
+    ) as pool:
+        for entry, err in zip(plots, pool.map(render, plots)):
+            if err is not None:
+                print(f"Failed: {entry['outfile']}\n{err}")
+                failed.append(entry)
+    return failed
+
+
+def _validate_file(p):
+    p = os.path.abspath(p)
+    if os.path.isfile(p):
+        return p
+    raise ValueError("Invalid spec file")
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-f", "--spec", type=_validate_file, help="JSON plot spec file"
+    )
+    p.add_argument(
+        "-j", "--jobs", default=os.cpu_count(), type=int, help="Worker count"
+    )
+    return p
+
+
+def main(args):
+    try:
+        plots = load_spec(args.spec)
+    except ValueError as e:
+        raise SystemExit(f"Invalid spec: {e}")
+    failed = render_all(plots, args.jobs)
+    print(f"Rendered {len(plots) - len(failed)}/{len(plots)} plots")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main(_get_parser().parse_args())
@@ -1,13 +1,8 @@
 import argparse
 import datetime as pydt
-import matplotlib.pyplot as plt
-import numpy as np
 import os
-import pendulum as pdm
-import seaborn as sns
-import xarray as xr
 
-from mean_plot import init_plotting
+from util import init_plotting
 
 
 MARKER_SIZE = 1
@@ -44,6 +39,9 @@ def _get_parser():
 
 
 def read_data(fname):
+    import pendulum as pdm
+    import xarray as xr
+
     ds = xr.open_dataset(fname)
     sst = ds.sea_surface_temperature
     times = sst.time.values
@@ -55,12 +53,17 @@ def read_data(fname):
 
 
 def get_smoothed(times, values, n=5*365*8):
+    import numpy as np
+
     kernel = np.ones(n, dtype=float) / n
     smoothed = np.convolve(values, kernel, "valid")
     return times[n//2:-n//2+1], smoothed
 
 
 def plot(times, values, args):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     ts, vs = get_smoothed(times, values, args.window)
     plt.figure(figsize=(16, 9))
     plt.plot(times, values, ".", ms=MARKER_SIZE, label="Three Hour Means")
@@ -90,8 +93,11 @@ def plot(times, values, args):
     plt.close()
 
 
-if __name__ == "__main__":
-    args = _get_parser().parse_args()
+def main(args):
     init_plotting()
     dates, values = read_data(args.infile)
     plot(dates, values, args)
+
+
+if __name__ == "__main__":
+    main(_get_parser().parse_args())
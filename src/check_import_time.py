@@ -0,0 +1,114 @@
+"""
+Regression check for the start up cost of the `sst` command.
+
+Runs `sst.py <command> --help` in a fresh interpreter for every command and
+fails if a heavy library gets imported or if the time over a bare
+interpreter start exceeds the budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+SST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sst.py")
+
+COMMANDS = [
+    [],
+    ["download"],
+    ["validate"],
+    ["stats"],
+    ["mean"],
+    ["plot"],
+    ["plot", "stats"],
+    ["plot", "mean"],
+    ["plot", "batch"],
+    ["frames"],
+]
+HEAVY_MODULES = [
+    "bs4",
+    "dask",
+    "matplotlib",
+    "numpy",
+    "pandas",
+    "pendulum",
+    "requests",
+    "seaborn",
+    "xarray",
+]
+
+_MARKER = "HEAVY:"
+# Reports the heavy modules loaded after running `sst.py --help`
+_PROBE = """
+import runpy, sys
+sys.argv = [{sst!r}] + {args!r} + ["--help"]
+sys.path.insert(0, {src!r})
+try:
+    runpy.run_path({sst!r}, run_name="__main__")
+except SystemExit:
+    pass
+heavy = {heavy!r}
+print({marker!r} + ",".join(m for m in heavy if m in sys.modules))
+"""
+
+
+def _time_run(cmd, repeat):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def check(budget, repeat):
+    base, _ = _time_run([sys.executable, "-c", "pass"], repeat)
+    print(f"Bare interpreter: {base * 1000:.0f} ms")
+    failures = []
+    for args in COMMANDS:
+        probe = _PROBE.format(
+            sst=SST,
+            src=os.path.dirname(SST),
+            args=args,
+            heavy=HEAVY_MODULES,
+            marker=_MARKER,
+        )
+        elapsed, out = _time_run([sys.executable, "-c", probe], repeat)
+        lines = out.stdout.splitlines()
+        lines = [ln for ln in lines if ln.startswith(_MARKER)]
+        heavy = lines[-1][len(_MARKER):] if lines else "unknown"
+        overhead = elapsed - base
+        name = " ".join(["sst"] + args + ["--help"])
+        print(f"{name:28} +{overhead * 1000:5.0f} ms {heavy}")
+        if heavy:
+            failures.append(f"{name} imported {heavy}")
+        if overhead > budget:
+            failures.append(f"{name} took {overhead * 1000:.0f} ms")
+    return failures
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-b",
+        "--budget",
+        default=0.1,
+        type=float,
+        help="Allowed seconds over a bare interpreter start",
+    )
+    p.add_argument(
+        "-n", "--repeat", default=3, type=int, help="Runs per command"
+    )
+    return p
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    failures = check(args.budget, args.repeat)
+    for f in failures:
+        print(f"FAIL: {f}")
+    if failures:
+        raise SystemExit(1)
+    print("OK")
@@ -4,8 +4,8 @@ archive. In particular, the 2012 data is troublesome because the headers for
 those files have somehow ended up masquerading as regular files in several
 other years.
 """
+import datetime as dt
 import glob
-import pendulum as pdm
 import os
 
 from util import FILE_DATE_RE, get_data_dir_arg_parser, get_year_dirs
@@ -25,7 +25,7 @@ def check_for_out_of_place_files(dir, year):
         if match is None:
             oop_files.append(f)
             continue
-        date = pdm.date(*[int(v) for v in match.groups()])
+        date = dt.date(*[int(v) for v in match.groups()])
         if date.year != year:
             oop_files.append(f)
             continue
@@ -64,9 +64,12 @@ def _get_parser():
     return p
 
 
-if __name__ == "__main__":
-    args = _get_parser().parse_args()
+def main(args):
     print("Validating")
     if args.oop:
         print("Checking for out of place files")
         remove_out_of_place_files(args.data_dir)
+
+
+if __name__ == "__main__":
+    main(_get_parser().parse_args())
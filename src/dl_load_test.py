@@ -0,0 +1,148 @@
+"""
+Load test for the downloader against the local fake archive.
+
+Starts fake_ncei.py's server in process, runs SSTBulkDownloader against it
+into a temporary directory and reports throughput along with how the
+downloader coped with the configured faults.
+"""
+import argparse
+import contextlib
+import glob
+import os
+import tempfile
+import time
+
+from fake_ncei import (
+    ERROR_CODES,
+    add_archive_args,
+    archive_from_args,
+    file_matches,
+    start_server,
+)
+from sst_data_dl import SSTBulkDownloader
+
+
+def check_downloads(archive, data_dir):
+    """Returns (good, bad, missing) file counts for a finished download."""
+    found = {
+        os.path.basename(f): f
+        for f in glob.glob(os.path.join(data_dir, "*", "*"))
+    }
+    good = 0
+    bad = 0
+    for name in archive.expected_files():
+        path = found.pop(name, None)
+        if path is None:
+            continue
+        with open(path, "rb") as fd:
+            data = fd.read()
+        if len(data) == archive.file_size and file_matches(name, data):
+            good += 1
+        else:
+            bad += 1
+    missing = len(archive.expected_files()) - good - bad
+    # Anything left over shouldn't have been downloaded at all
+    return good, bad + len(found), missing
+
+
+def run_load_test(archive, time_buffer=0.0, verbose=False):
+    server, url = start_server(archive)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            data_dir = os.path.join(tmp, "data")
+            dloader = SSTBulkDownloader(
+                url,
+                data_dir,
+                time_buffer=time_buffer,
+                target_cache_dir=os.path.join(tmp, "cache"),
+            )
+            start = time.perf_counter()
+            if verbose:
+                dloader.run(use_cache=False)
+            else:
+                with open(os.devnull, "w") as null:
+                    with contextlib.redirect_stdout(null):
+                        with contextlib.redirect_stderr(null):
+                            dloader.run(use_cache=False)
+            elapsed = time.perf_counter() - start
+            good, bad, missing = check_downloads(archive, data_dir)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        "elapsed": elapsed,
+        "expected": len(archive.expected_files()),
+        "good": good,
+        "bad": bad,
+        "missing": missing,
+        "bytes": dloader.total_bytes,
+    }
+
+
+def injected_faults(archive):
+    """Returns (errors, drops) the archive injected during a run."""
+    errors = sum(archive.status_counts.get(c, 0) for c in ERROR_CODES)
+    return errors, archive.dropped
+
+
+def check_result(archive, result):
+    """Returns a list of failures for a finished run.
+
+    Every injected fault may cost at most one file but nothing may be saved
+    with the wrong content.
+    """
+    failures = []
+    if result["bad"]:
+        failures.append(f"{result['bad']} bad files saved")
+    faults = sum(injected_faults(archive))
+    if result["missing"] > faults:
+        failures.append(
+            f"{result['missing']} files missing with {faults} injected faults"
+        )
+    return failures
+
+
+def print_report(archive, result):
+    elapsed = result["elapsed"]
+    mb = result["bytes"] / (1024 * 1024)
+    print(f"Files: {result['good']}/{result['expected']} good")
+    print(f"  Bad (wrong size or content): {result['bad']}")
+    print(f"  Missing: {result['missing']}")
+    print(f"Time: {elapsed:.2f} s")
+    print(f"Throughput: {result['good'] / elapsed:.2f} files/s")
+    print(f"Throughput: {mb / elapsed:.2f} MB/s")
+    statuses = ", ".join(
+        f"{k}: {v}" for k, v in sorted(archive.status_counts.items())
+    )
+    print(f"Server requests: {archive.requests} ({statuses})")
+    errors, drops = injected_faults(archive)
+    print(f"Injected faults: {errors} errors, {drops} drops")
+    print(f"Server max concurrent requests: {archive.max_active}")
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-b",
+        "--time-buffer",
+        default=0.0,
+        type=float,
+        help="Downloader delay between files",
+    )
+    p.add_argument(
+        "-v", "--verbose", action="store_true", help="Show downloader output"
+    )
+    return add_archive_args(p)
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    archive = archive_from_args(args)
+    result = run_load_test(archive, args.time_buffer, args.verbose)
+    print_report(archive, result)
+    failures = check_result(archive, result)
+    for f in failures:
+        print(f"FAIL: {f}")
+    if failures:
+        raise SystemExit(1)
+    print("OK")
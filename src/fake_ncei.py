@@ -0,0 +1,319 @@
+"""
+Local stand-in for the NCEI SST archive.
+
+Serves year index pages and synthetic `SEAFLUX-OSB-CDR_*.nc` files laid out
+like the real archive so that the downloader can be exercised without the
+network. Faults seen on the real site can be switched on: latency, capped
+bandwidth, missing Content-Length, files from 2012 listed under other years,
+dropped connections and 429/5xx responses.
+"""
+import argparse
+import datetime as dt
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import random
+import re
+import threading
+import time
+
+from util import FILE_DATE_RE
+
+
+ACCESS_PATH = "/data/sea-surface-temperature-whoi/access/"
+ERROR_CODES = [429, 500, 502, 503]
+# The year whose files show up in other years' directories on the real site
+MISPLACED_YEAR = 2012
+
+_FILE_FMT = "SEAFLUX-OSB-CDR_V02R00_SST_D{:%Y%m%d}_C20160820.nc"
+_PATH_RE = re.compile(
+    "^" + re.escape(ACCESS_PATH) + "(?:(\\d{4})/(?:([^/]+))?)?$"
+)
+_BLOCK_SIZE = 64 * 1024
+
+
+def file_names(year, count):
+    start = dt.date(year, 1, 1)
+    days = [start + dt.timedelta(days=i) for i in range(count)]
+    return [_FILE_FMT.format(d) for d in days]
+
+
+def _file_block(name):
+    """The repeating block that makes up the body of file `name`."""
+    digest = hashlib.sha256(name.encode()).digest()
+    return (digest * (_BLOCK_SIZE // len(digest) + 1))[:_BLOCK_SIZE]
+
+
+def file_matches(name, data):
+    """Checks downloaded bytes against what the archive serves for `name`."""
+    block = _file_block(name)
+    for i in range(0, len(data), _BLOCK_SIZE):
+        chunk = data[i:i + _BLOCK_SIZE]
+        if chunk != block[:len(chunk)]:
+            return False
+    return True
+
+
+class FakeArchive:
+    """Archive layout, fault settings and request statistics."""
+
+    def __init__(
+        self,
+        years=(1988, 1989),
+        files_per_year=10,
+        file_size=1024 * 1024,
+        latency=0.0,
+        bandwidth=0,
+        no_content_length=False,
+        misplaced=0,
+        drop_rate=0.0,
+        error_rate=0.0,
+        seed=0,
+    ):
+        self.years = sorted(years)
+        self.file_size = file_size
+        # Seconds before every response
+        self.latency = latency
+        # Bytes per second per connection, 0 for no cap
+        self.bandwidth = bandwidth
+        self.no_content_length = no_content_length
+        # Chance of cutting off a file transfer half way
+        self.drop_rate = drop_rate
+        # Chance of answering a file request with one of ERROR_CODES
+        self.error_rate = error_rate
+        self.listings = {}
+        for y in self.years:
+            self.listings[y] = file_names(y, files_per_year)
+            if y != MISPLACED_YEAR:
+                self.listings[y] += file_names(MISPLACED_YEAR, misplaced)
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.status_counts = {}
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.active = 0
+        self.max_active = 0
+
+    def expected_files(self):
+        """Files the downloader should fetch. Misplaced files are excluded."""
+        out = []
+        for y, names in self.listings.items():
+            for n in names:
+                if int(FILE_DATE_RE.match(n).group(1)) == y:
+                    out.append(n)
+        return out
+
+    def roll(self, rate):
+        with self._lock:
+            return self._rand.random() < rate
+
+    def choose_error(self):
+        with self._lock:
+            return self._rand.choice(ERROR_CODES)
+
+    def record(self, status=None, nbytes=0, active=0, dropped=False):
+        with self._lock:
+            if status is not None:
+                self.requests += 1
+                self.status_counts[status] = (
+                    self.status_counts.get(status, 0) + 1
+                )
+            self.bytes_sent += nbytes
+            self.dropped += dropped
+            self.active += active
+            self.max_active = max(self.max_active, self.active)
+
+
+def _index_page(title, links):
+    items = "\n".join(f'<a href="{ln}">{ln}</a><br>' for ln in links)
+    return (
+        f"<html><head><title>Index of {title}</title></head>\n"
+        f"<body><h1>Index of {title}</h1>\n"
+        f'<a href="../">Parent Directory</a><br>\n{items}\n</body></html>\n'
+    ).encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        archive = self.server.archive
+        archive.record(active=1)
+        try:
+            if archive.latency:
+                time.sleep(archive.latency)
+            self._route(archive)
+        finally:
+            archive.record(active=-1)
+
+    def _route(self, archive):
+        match = _PATH_RE.match(self.path)
+        if match is None:
+            return self._send_status(archive, 404)
+        year, name = match.groups()
+        if year is None:
+            links = [f"{y}/" for y in archive.years]
+            return self._send_page(archive, _index_page(self.path, links))
+        year = int(year)
+        if year not in archive.listings:
+            return self._send_status(archive, 404)
+        if name is None:
+            page = _index_page(self.path, archive.listings[year])
+            return self._send_page(archive, page)
+        if name not in archive.listings[year]:
+            return self._send_status(archive, 404)
+        if archive.roll(archive.error_rate):
+            return self._send_status(archive, archive.choose_error())
+        self._send_file(archive, name)
+
+    def _send_status(self, archive, code):
+        body = f"{code} {self.responses[code][0]}\n".encode()
+        self.send_response(code)
+        if code == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        archive.record(code, len(body))
+
+    def _send_page(self, archive, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        archive.record(200, len(body))
+
+    def _send_file(self, archive, name):
+        size = archive.file_size
+        drop = archive.roll(archive.drop_rate)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-netcdf")
+        if not archive.no_content_length:
+            self.send_header("Content-Length", str(size))
+        self.end_headers()
+        archive.record(200)
+        limit = size // 2 if drop else size
+        block = _file_block(name)
+        # Small writes keep the bandwidth cap smooth
+        step = _BLOCK_SIZE
+        if archive.bandwidth:
+            step = max(1, min(step, archive.bandwidth // 10))
+        sent = 0
+        try:
+            while sent < limit:
+                n = min(step, limit - sent)
+                offset = sent % _BLOCK_SIZE
+                chunk = (block[offset:] + block)[:n]
+                self.wfile.write(chunk)
+                sent += n
+                archive.record(nbytes=n)
+                # No pause after the last chunk so the request doesn't look
+                # active after the client already has everything
+                if archive.bandwidth and sent < limit:
+                    time.sleep(n / archive.bandwidth)
+        except ConnectionError:
+            return
+        if drop:
+            archive.record(dropped=True)
+            self.close_connection = True
+
+
+def start_server(archive, host="127.0.0.1", port=0):
+    """Starts serving `archive` in a background thread.
+
+    Returns the server and the base URL to hand to the downloader. Call
+    `shutdown()` on the server when done.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.archive = archive
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}{ACCESS_PATH}"
+
+
+def add_archive_args(p):
+    p.add_argument(
+        "-y",
+        "--years",
+        nargs="+",
+        type=int,
+        default=[1988, 1989],
+        help="Years in the archive",
+    )
+    p.add_argument(
+        "-n", "--files-per-year", default=10, type=int, help="Files per year"
+    )
+    p.add_argument(
+        "-z", "--file-size", default=1024 * 1024, type=int, help="File bytes"
+    )
+    p.add_argument(
+        "--latency", default=0.0, type=float, help="Seconds per response"
+    )
+    p.add_argument(
+        "--bandwidth",
+        default=0,
+        type=int,
+        help="Bytes per second per connection (0 for no cap)",
+    )
+    p.add_argument(
+        "--no-content-length",
+        action="store_true",
+        help="Omit Content-Length for data files",
+    )
+    p.add_argument(
+        "--misplaced",
+        default=0,
+        type=int,
+        help=f"{MISPLACED_YEAR} files to list under every other year",
+    )
+    p.add_argument(
+        "--drop-rate",
+        default=0.0,
+        type=float,
+        help="Chance of dropping a transfer half way",
+    )
+    p.add_argument(
+        "--error-rate",
+        default=0.0,
+        type=float,
+        help="Chance of a 429/5xx response to a file request",
+    )
+    p.add_argument("--seed", default=0, type=int, help="Random seed")
+    return p
+
+
+def archive_from_args(args):
+    return FakeArchive(
+        years=args.years,
+        files_per_year=args.files_per_year,
+        file_size=args.file_size,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        no_content_length=args.no_content_length,
+        misplaced=args.misplaced,
+        drop_rate=args.drop_rate,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument("-p", "--port", default=8000, type=int, help="Port")
+    return add_archive_args(p)
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    server, url = start_server(archive_from_args(args), port=args.port)
+    print(f"Serving fake archive at {url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -28,4 +28,4 @@ fi
 
 
 ls $datadir/*/*.nc | parallel -I% --max-args 1 --progress -j$njobs $resume --joblog par.log \
-    src/plotframes.sh -w $workdir -f $framedir -i % $split | tee -a my.log
+    $(dirname $0)/plotframes.sh -w $workdir -f $framedir -i % $split | tee -a my.log
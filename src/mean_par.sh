@@ -28,7 +28,7 @@ rm "$outdir"/*.nc
 
 # Run in parallel
 ls $datadir/*/*.nc | parallel -I% --max-args 1 --progress -j$njobs $resume --joblog logs/mean_par.log \
-    src/mean_nc.sh -o $outdir -i % | tee -a logs/mean.log
+    $(dirname $0)/mean_nc.sh -o $outdir -i % | tee -a logs/mean.log
 
 final="$outdir/sst-mean.nc"
 tmp="${final}.tmp"
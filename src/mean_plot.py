@@ -1,10 +1,8 @@
 import argparse
 import datetime as dt
-import matplotlib.pyplot as plt
-import numpy as np
 import os
-import pendulum as pdm
-import seaborn as sns
+
+from util import init_plotting
 
 
 MARKER_SIZE = 1
@@ -13,6 +11,9 @@ OUT_DPI = 150
 
 
 def read_data(fd):
+    import numpy as np
+    import pendulum as pdm
+
     ts = []
     mi = []
     ma = []
@@ -29,13 +30,10 @@ def read_data(fd):
     return ts, np.array(mi), np.array(ma), np.array(me)
 
 
-def init_plotting():
-    sns.set()
-    sns.set_style("white")
-    sns.set_style("ticks")
-
-
 def make_plot(data, args):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(16, 9))
     plt.plot(data[0], data[3], ".", ms=MARKER_SIZE)
     plt.title(args.title, fontsize=FONT_SIZE)
@@ -78,9 +76,12 @@ def _get_parser():
     return p
 
 
-if __name__ == "__main__":
-    args = _get_parser().parse_args()
+def main(args):
     with open(args.infile) as fd:
         data = read_data(fd)
     init_plotting()
     make_plot(data, args)
+
+
+if __name__ == "__main__":
+    main(_get_parser().parse_args())
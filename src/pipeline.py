@@ -0,0 +1,596 @@
+"""
+Incremental build of the full workflow: download, validate, stats, means,
+frames and video.
+
+Every step is a task that maps input files to output files. A task is only
+rerun when the content of its inputs or its parameters differ from the last
+successful run, so adding new data files only rebuilds the outputs that
+depend on them. Tasks that don't depend on each other run concurrently.
+"""
+import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+import traceback
+
+from data_validate import check_for_out_of_place_files
+from util import get_year_dirs
+
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = "pipeline-state.json"
+STAGES = ["stats", "mean", "trend", "frames", "video"]
+
+_HASH_CHUNK = 4 * 1024 * 1024
+# Minimum seconds between state saves while running
+_SAVE_INTERVAL = 5.0
+
+
+class Task:
+    """A single build step that turns input files into output files.
+
+    `action` must be a module level function so that it can be sent to a
+    worker process. It is called as `action(inputs, outputs, params)`.
+    `code` lists the source files that define the task. They are part of
+    the signature but aren't passed to the action.
+    """
+
+    def __init__(self, name, action, inputs, outputs, params=None, code=()):
+        self.name = name
+        self.action = action
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = dict(params or {})
+        self.code = list(code)
+
+
+class FileHasher:
+    """Computes content hashes of files.
+
+    Hashes are memoized on file size and modification time so that
+    unchanged files are only read once.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or {}
+
+    def hash(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = self.cache.get(path)
+        if (
+            entry is not None
+            and entry[0] == st.st_size
+            and entry[1] == st.st_mtime_ns
+        ):
+            return entry[2]
+        h = hashlib.sha1()
+        with open(path, "rb") as fd:
+            for chunk in iter(lambda: fd.read(_HASH_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self.cache[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+
+def _run_task(action, inputs, outputs, params):
+    for o in outputs:
+        os.makedirs(os.path.dirname(os.path.abspath(o)), exist_ok=True)
+    action(inputs, outputs, params)
+
+
+class Pipeline:
+    """Dependency graph of tasks with content addressed rebuilds."""
+
+    def __init__(self, state_path, njobs=1):
+        self._state_path = os.path.abspath(state_path)
+        self._njobs = njobs
+        self._tasks = []
+        self._producers = {}
+        state = {}
+        if os.path.isfile(self._state_path):
+            with open(self._state_path) as fd:
+                state = json.load(fd)
+        self._signatures = state.get("tasks", {})
+        self._hasher = FileHasher(state.get("hashes", {}))
+
+    def add(self, task):
+        for o in task.outputs:
+            if o in self._producers:
+                raise ValueError(f"Output produced by multiple tasks: {o}")
+            self._producers[o] = task
+        self._tasks.append(task)
+        return task
+
+    def _save_state(self):
+        state = {"tasks": self._signatures, "hashes": self._hasher.cache}
+        os.makedirs(os.path.dirname(self._state_path), exist_ok=True)
+        tmp = self._state_path + ".tmp"
+        with open(tmp, "w") as fd:
+            json.dump(state, fd)
+        os.replace(tmp, self._state_path)
+
+    def _signature(self, task):
+        action = f"{task.action.__module__}.{task.action.__qualname__}"
+        inputs = [(i, self._hasher.hash(i)) for i in task.inputs]
+        code = [(c, self._hasher.hash(c)) for c in task.code]
+        blob = json.dumps(
+            {
+                "action": action,
+                "params": task.params,
+                "inputs": inputs,
+                "code": code,
+                "outputs": task.outputs,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+    def _is_current(self, task, sig):
+        if self._signatures.get(task.name) != sig:
+            return False
+        return all(os.path.exists(o) for o in task.outputs)
+
+    def run(self):
+        """Runs all out of date tasks. Returns True if no task failed."""
+        deps = {}
+        dependents = {t.name: [] for t in self._tasks}
+        for t in self._tasks:
+            producers = {
+                self._producers[i].name
+                for i in t.inputs
+                if i in self._producers
+            }
+            deps[t.name] = len(producers)
+            for p in producers:
+                dependents[p].append(t)
+        ready = deque(t for t in self._tasks if deps[t.name] == 0)
+        failed = set()
+        running = {}
+        built = 0
+        skipped = 0
+        finished = 0
+        last_save = time.monotonic()
+
+        def _release(task):
+            nonlocal finished
+            finished += 1
+            for d in dependents[task.name]:
+                deps[d.name] -= 1
+                if deps[d.name] == 0:
+                    ready.append(d)
+
+        print(f"Tasks: {len(self._tasks)}")
+        with ProcessPoolExecutor(self._njobs) as pool:
+            while ready or running:
+                while ready:
+                    t = ready.popleft()
+                    upstream = [
+                        self._producers[i].name
+                        for i in t.inputs
+                        if i in self._producers
+                    ]
+                    if any(u in failed for u in upstream):
+                        print(f"Skipping (upstream failed): {t.name}")
+                        failed.add(t.name)
+                        _release(t)
+                        continue
+                    missing = [i for i in t.inputs if not os.path.exists(i)]
+                    if missing:
+                        print(f"Missing input for {t.name}: {missing[0]}")
+                        failed.add(t.name)
+                        _release(t)
+                        continue
+                    sig = self._signature(t)
+                    if self._is_current(t, sig):
+                        skipped += 1
+                        _release(t)
+                        continue
+                    print(f"Running: {t.name}")
+                    fut = pool.submit(
+                        _run_task, t.action, t.inputs, t.outputs, t.params
+                    )
+                    running[fut] = (t, sig)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    t, sig = running.pop(fut)
+                    try:
+                        fut.result()
+                    except Exception:
+                        print(f"Task failed: {t.name}")
+                        traceback.print_exc()
+                        failed.add(t.name)
+                        self._signatures.pop(t.name, None)
+                    else:
+                        print(f"Done: {t.name}")
+                        self._signatures[t.name] = sig
+                        built += 1
+                    _release(t)
+                # The state gets large, so don't rewrite it on every task
+                if time.monotonic() - last_save > _SAVE_INTERVAL:
+                    self._save_state()
+                    last_save = time.monotonic()
+        self._save_state()
+        if finished != len(self._tasks):
+            raise ValueError("Dependency cycle in pipeline tasks")
+        print(f"Built: {built}, up to date: {skipped}, failed: {len(failed)}")
+        return not failed
+
+
+def _check_call(cmd):
+    # No stdin so that a tool asking a question fails instead of hanging
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+
+
+def _script(name):
+    return os.path.join(SRC_DIR, name)
+
+
+def _module_file(name):
+    return os.path.join(SRC_DIR, name + ".py")
+
+
+def _base_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# Task actions
+
+
+def file_stats(inputs, outputs, params):
+    from sst_extract_stats import _write_line, extract_file_stats
+
+    tmp = outputs[0] + ".tmp"
+    with open(tmp, "w") as fd:
+        for values in extract_file_stats(inputs[0]):
+            _write_line(fd, *values)
+    os.replace(tmp, outputs[0])
+
+
+def combine_stats(inputs, outputs, params):
+    from sst_extract_stats import _write_line, HEADERS
+
+    tmp = outputs[0] + ".tmp"
+    with open(tmp, "w") as fd:
+        _write_line(fd, *HEADERS)
+        for f in inputs:
+            with open(f) as rows:
+                shutil.copyfileobj(rows, fd)
+    os.replace(tmp, outputs[0])
+
+
+def file_mean(inputs, outputs, params):
+    infile = inputs[0]
+    outdir = os.path.dirname(outputs[0])
+    # ncks won't overwrite the result of an earlier run without prompting
+    if os.path.exists(outputs[0]):
+        os.remove(outputs[0])
+    _check_call(["bash", _script("mean_nc.sh"), "-o", outdir, "-i", infile])
+
+
+def combine_means(inputs, outputs, params):
+    tmp = outputs[0] + ".tmp"
+    _check_call(["ncrcat", "-O", *inputs, tmp])
+    os.replace(tmp, outputs[0])
+
+
+def year_trend(inputs, outputs, params):
+    from sst_trend import accumulate_files
+
+    tmp = outputs[0] + ".tmp"
+    accumulate_files(inputs).save(tmp)
+    os.replace(tmp, outputs[0])
+
+
+def combine_trend(inputs, outputs, params):
+    from sst_trend import TrendAccumulator, write_trend
+
+    acc = TrendAccumulator.load(inputs[0])
+    for f in inputs[1:]:
+        acc.merge(TrendAccumulator.load(f))
+    write_trend(acc, outputs[0])
+
+
+def file_frames(inputs, outputs, params):
+    """Renders the frames for one data file.
+
+    The output is a manifest listing each frame with its content hash so
+    that downstream tasks see changes to the frames themselves.
+    """
+    infile = inputs[0]
+    manifest = outputs[0]
+    staging = os.path.splitext(manifest)[0]
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    os.makedirs(params["frame_dir"], exist_ok=True)
+    cmd = [
+        "bash",
+        _script("plotframes.sh"),
+        "-w",
+        params["tmp_dir"],
+        "-f",
+        staging,
+        "-i",
+        infile,
+    ]
+    if params["split"]:
+        cmd.append("-s")
+    _check_call(cmd)
+    hasher = FileHasher()
+    lines = []
+    for f in sorted(glob.glob(os.path.join(staging, "*.png"))):
+        dest = os.path.join(params["frame_dir"], os.path.basename(f))
+        os.replace(f, dest)
+        lines.append(f"{hasher.hash(dest)} {dest}\n")
+    shutil.rmtree(staging)
+    if not lines:
+        raise IOError(f"No frames rendered for {infile}")
+    with open(manifest, "w") as fd:
+        fd.writelines(lines)
+
+
+def video_segment(inputs, outputs, params):
+    frames = []
+    for m in inputs:
+        with open(m) as fd:
+            frames.extend(line.split(" ", 1)[1].strip() for line in fd)
+    frames.sort()
+    duration = 1.0 / params["fps"]
+    list_file = outputs[0] + ".txt"
+    with open(list_file, "w") as fd:
+        for f in frames:
+            fd.write(f"file '{f}'\nduration {duration}\n")
+        # The concat demuxer ignores the duration of the last entry
+        fd.write(f"file '{frames[-1]}'\n")
+    tmp = outputs[0] + ".tmp.mp4"
+    _check_call(
+        [
+            "ffmpeg",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_file,
+            "-r",
+            str(params["fps"]),
+            "-c:v",
+            "libx264",
+            "-pix_fmt",
+            "yuv420p",
+            "-vf",
+            "scale=1280:-2",
+            tmp,
+        ]
+    )
+    os.remove(list_file)
+    os.replace(tmp, outputs[0])
+
+
+def concat_video(inputs, outputs, params):
+    list_file = outputs[0] + ".txt"
+    with open(list_file, "w") as fd:
+        for f in inputs:
+            fd.write(f"file '{os.path.abspath(f)}'\n")
+    tmp = outputs[0] + ".tmp.mp4"
+    _check_call(
+        [
+            "ffmpeg",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_file,
+            "-c",
+            "copy",
+            tmp,
+        ]
+    )
+    os.remove(list_file)
+    os.replace(tmp, outputs[0])
+
+
+def get_year_files(data_dir):
+    """Returns a sorted list of (year, [data files]) pairs.
+
+    Out of place files (see data_validate.py) are left out.
+    """
+    out = []
+    for yd in sorted(get_year_dirs(data_dir)):
+        y = os.path.basename(yd)
+        oop = set(check_for_out_of_place_files(yd, int(y)))
+        files = sorted(glob.glob(os.path.join(yd, "*.nc")))
+        files = [f for f in files if f not in oop]
+        if oop:
+            print(f"Ignoring {len(oop)} out of place files in {y}")
+        if files:
+            out.append((y, files))
+    return out
+
+
+def build_pipeline(pipe, args):
+    work = args.work_dir
+    year_files = get_year_files(args.data_dir)
+
+    if "stats" in args.stages:
+        rows = []
+        code = [_module_file("sst_extract_stats")]
+        for _, files in year_files:
+            for f in files:
+                name = _base_name(f)
+                out = os.path.join(work, "stats", name + ".csv")
+                pipe.add(
+                    Task(f"stats:{name}", file_stats, [f], [out], code=code)
+                )
+                rows.append(out)
+        pipe.add(
+            Task(
+                "stats",
+                combine_stats,
+                rows,
+                [os.path.join(args.out_dir, "sst-stats.csv")],
+                code=code,
+            )
+        )
+
+    if "mean" in args.stages:
+        means = []
+        code = [_script("mean_nc.sh")]
+        for _, files in year_files:
+            for f in files:
+                name = _base_name(f)
+                out = os.path.join(work, "mean", os.path.basename(f))
+                pipe.add(
+                    Task(f"mean:{name}", file_mean, [f], [out], code=code)
+                )
+                means.append(out)
+        pipe.add(
+            Task(
+                "mean",
+                combine_means,
+                means,
+                [os.path.join(args.out_dir, "sst-mean.nc")],
+            )
+        )
+
+    if "trend" in args.stages:
+        partials = []
+        code = [_module_file("sst_trend")]
+        for y, files in year_files:
+            out = os.path.join(work, "trend", f"{y}.npz")
+            pipe.add(Task(f"trend:{y}", year_trend, files, [out], code=code))
+            partials.append(out)
+        pipe.add(
+            Task(
+                "trend",
+                combine_trend,
+                partials,
+                [os.path.join(args.out_dir, "sst-trend.nc")],
+                code=code,
+            )
+        )
+
+    if "frames" in args.stages or "video" in args.stages:
+        scripts = [_script("plotframes.sh"), _script("plotnc.sh")]
+        # The video actions are defined in this module
+        video_code = [_module_file("pipeline")]
+        params = {
+            "frame_dir": args.frame_dir,
+            "tmp_dir": os.path.join(work, "tmp"),
+            "split": args.split,
+        }
+        segments = []
+        for y, files in year_files:
+            manifests = []
+            for f in files:
+                out = os.path.join(work, "frames", _base_name(f) + ".txt")
+                pipe.add(
+                    Task(
+                        f"frames:{_base_name(f)}",
+                        file_frames,
+                        [f],
+                        [out],
+                        params,
+                        code=scripts,
+                    )
+                )
+                manifests.append(out)
+            if "video" in args.stages:
+                out = os.path.join(work, "video", f"{y}.mp4")
+                pipe.add(
+                    Task(
+                        f"video:{y}",
+                        video_segment,
+                        manifests,
+                        [out],
+                        {"fps": args.fps},
+                        code=video_code,
+                    )
+                )
+                segments.append(out)
+        if "video" in args.stages:
+            pipe.add(
+                Task(
+                    "video",
+                    concat_video,
+                    segments,
+                    [os.path.join(args.out_dir, "sst.mp4")],
+                    code=video_code,
+                )
+            )
+    return pipe
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument("-d", "--data-dir", default="data", help="Data directory")
+    p.add_argument(
+        "-w", "--work-dir", default="working", help="Intermediate file dir"
+    )
+    p.add_argument(
+        "-f", "--frame-dir", default="plots/frames", help="Frame output dir"
+    )
+    p.add_argument(
+        "-o", "--out-dir", default="output", help="Final output directory"
+    )
+    p.add_argument("-c", "--cache-dir", default="cache", help="Cache dir")
+    p.add_argument(
+        "-j", "--jobs", default=os.cpu_count(), type=int, help="Worker count"
+    )
+    p.add_argument(
+        "-s",
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="Stages to build",
+    )
+    p.add_argument(
+        "--download", action="store_true", help="Download new data first"
+    )
+    p.add_argument(
+        "--validate",
+        action="store_true",
+        help="Remove out of place data files before building",
+    )
+    p.add_argument(
+        "--split", action="store_true", help="One frame per time slice"
+    )
+    p.add_argument("--fps", default=30, type=int, help="Video frame rate")
+    return p
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    for k in ["data_dir", "work_dir", "frame_dir", "out_dir", "cache_dir"]:
+        setattr(args, k, os.path.abspath(getattr(args, k)))
+    if args.download:
+        from sst_data_dl import BASE_URL, SSTBulkDownloader
+
+        os.makedirs(args.data_dir, exist_ok=True)
+        SSTBulkDownloader(
+            BASE_URL,
+            args.data_dir,
+            time_buffer=0.001,
+            target_cache_dir=args.cache_dir,
+        ).run(use_cache=False)
+    if args.validate:
+        from data_validate import remove_out_of_place_files
+
+        remove_out_of_place_files(args.data_dir)
+    pipe = Pipeline(os.path.join(args.work_dir, STATE_FILE), args.jobs)
+    build_pipeline(pipe, args)
+    if not pipe.run():
+        raise SystemExit(1)
@@ -1,9 +1,19 @@
 #!/bin/bash
-while getopts f:t:i: opts; do
+# Defaults are for plotting SST. Use -v, -c, -T and -l to plot another
+# variable, e.g. the slope grid from sst_trend.py.
+var=
+cmap=viridis
+range=-2/36/1
+label="Sea Surface Temp. (\260C)"
+while getopts f:t:i:v:c:T:l: opts; do
     case ${opts} in
         f) framedir=${OPTARG%/} ;;
         t) title=${OPTARG} ;;
         i) infile=${OPTARG} ;;
+        v) var=${OPTARG} ;;
+        c) cmap=${OPTARG} ;;
+        T) range=${OPTARG} ;;
+        l) label=${OPTARG} ;;
     esac
 done
 
@@ -21,15 +31,24 @@ title=$(echo $title | xargs)
 
 framefile="$framedir/frame_$title.ps"
 
-if [ ! -f sst.cpt ]; then
-    gmt makecpt -Cviridis -T-2/36/1 -Z > sst.cpt
+grid=$infile
+ticks=a6f
+if [ -n "$var" ]; then
+    grid="${infile}?${var}"
+    ticks=af
 fi
 
+# Build the palette for every call. A shared cached file would ignore -c/-T
+# changes and can be read half written by parallel workers.
+cpt=$(mktemp --suffix=.cpt)
+trap 'rm -f "$cpt"' EXIT
+gmt makecpt -C$cmap -T$range -Z > $cpt || exit 2
+
 w=7i
 
-gmt grdimage $infile -Rg -JKs180/$w -B+t"$title" -Csst.cpt -P -K > $framefile
+gmt grdimage "$grid" -Rg -JKs180/$w -B+t"$title" -C$cpt -P -K > $framefile
 gmt pscoast -Rg -JKs180/$w -Bafg -Dc -A5000 -Wthinnest -Gwhite -O -K >> $framefile
 gmt psscale -Rg -JKs180/$w -DJMR+w4i/0.5+v+o0.75i/0i+ma \
-    -Bx+l"Sea Surface Temp. (\260C)" --FONT_LABEL=11p -Csst.cpt -Ba6f -O >> $framefile
+    -Bx+l"$label" --FONT_LABEL=11p -C$cpt -B$ticks -O >> $framefile
 # -A: L/R/B/T
 gmt psconvert $framefile -P -E300 -Tg -A0.3i/1.2i/0.5i/0.3i -Z
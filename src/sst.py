@@ -0,0 +1,115 @@
+"""
+Single entry point for the SST tools.
+
+Each subcommand's module keeps its heavy imports (matplotlib, xarray, dask,
+...) inside the functions that need them, so building this parser and
+running `--help` stays fast. Use check_import_time.py to verify.
+"""
+import argparse
+import os
+import subprocess
+
+import batch_plot
+import bounded_mean_plot
+import data_validate
+import mean_plot
+import sst_data_dl
+import sst_extract_stats
+
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run_script(name, opts):
+    cmd = ["bash", os.path.join(SRC_DIR, name)] + opts
+    raise SystemExit(subprocess.run(cmd).returncode)
+
+
+def _mean(args):
+    opts = ["-d", args.data_dir, "-o", args.out_dir, "-j", str(args.jobs)]
+    if args.resume:
+        opts.append("-r")
+    _run_script("mean_par.sh", opts)
+
+
+def _frames(args):
+    opts = [
+        "-w",
+        args.work_dir,
+        "-f",
+        args.frame_dir,
+        "-d",
+        args.data_dir,
+        "-j",
+        str(args.jobs),
+    ]
+    if args.resume:
+        opts.append("-r")
+    if args.split:
+        opts.append("-s")
+    _run_script("gen_frames_par.sh", opts)
+
+
+def _add_module_command(sub, name, module, help_):
+    p = sub.add_parser(
+        name, parents=[module._get_parser()], add_help=False, help=help_
+    )
+    p.set_defaults(func=module.main)
+    return p
+
+
+def _add_parallel_opts(p):
+    p.add_argument("-d", "--data-dir", default="data", help="Data directory")
+    p.add_argument(
+        "-j", "--jobs", default=os.cpu_count(), type=int, help="Job count"
+    )
+    p.add_argument(
+        "-r", "--resume", action="store_true", help="Resume from job log"
+    )
+
+
+def _get_parser():
+    p = argparse.ArgumentParser(prog="sst")
+    sub = p.add_subparsers(dest="command", metavar="command")
+    sub.required = True
+
+    _add_module_command(sub, "download", sst_data_dl, "Download data files")
+    _add_module_command(
+        sub, "validate", data_validate, "Clean up the data tree"
+    )
+    _add_module_command(
+        sub, "stats", sst_extract_stats, "Extract min/max/mean stats"
+    )
+
+    mp = sub.add_parser("mean", help="Compute the spatial mean series")
+    _add_parallel_opts(mp)
+    mp.add_argument("-o", "--out-dir", default="mean", help="Output dir")
+    mp.set_defaults(func=_mean)
+
+    pp = sub.add_parser("plot", help="Plot stats or mean series")
+    psub = pp.add_subparsers(dest="kind", metavar="kind")
+    psub.required = True
+    _add_module_command(psub, "stats", mean_plot, "Plot the stats file")
+    _add_module_command(
+        psub, "mean", bounded_mean_plot, "Plot the smoothed mean file"
+    )
+    _add_module_command(
+        psub, "batch", batch_plot, "Render many plots from a spec file"
+    )
+
+    fp = sub.add_parser("frames", help="Render map frames")
+    _add_parallel_opts(fp)
+    fp.add_argument("-w", "--work-dir", default="working", help="Work dir")
+    fp.add_argument(
+        "-f", "--frame-dir", default="plots/frames", help="Frame output dir"
+    )
+    fp.add_argument(
+        "-s", "--split", action="store_true", help="One frame per time slice"
+    )
+    fp.set_defaults(func=_frames)
+    return p
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    args.func(args)
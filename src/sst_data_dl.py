@@ -1,14 +1,17 @@
 #!~/anaconda3/bin/python3
 import argparse
-from bs4 import BeautifulSoup as BSoup, SoupStrainer
+import datetime as dt
 import os
-import pendulum as pdm
 import re
-import requests
 import time
 import traceback
-from urllib.request import urljoin, urlopen
+from urllib.parse import urljoin
 
+from transcode import (
+    BackgroundTranscoder,
+    DEFAULT_COMPLEVEL,
+    DEFAULT_PRECISION,
+)
 from util import cache_data, FILE_DATE_RE, load_cached_data, ProgressIndicator
 
 
@@ -28,6 +31,9 @@ def _is_data_file(s):
 
 
 def _scrape_links(url, filter_func=None):
+    from bs4 import BeautifulSoup as BSoup, SoupStrainer
+    from urllib.request import urlopen
+
     print(f"Scraping for links: {url}")
     filter_func = filter_func or (lambda x: True)
     a_tags = SoupStrainer("a")
@@ -51,7 +57,7 @@ def _scrape_data_file_names(url):
 def _validate_furl(url, year):
     fname = os.path.basename(url)
     date_match = FILE_DATE_RE.match(fname)
-    date = pdm.date(*[int(v) for v in date_match.groups()])
+    date = dt.date(*[int(v) for v in date_match.groups()])
     if date.year != int(year):
         return False
     return True
@@ -77,7 +83,12 @@ class SSTBulkDownloader:
     """Class that performs a bulk download of NOAA SST data files."""
 
     def __init__(
-        self, base_url, dest_dir, time_buffer=0.1, target_cache_dir=CACHE_DIR
+        self,
+        base_url,
+        dest_dir,
+        time_buffer=0.1,
+        target_cache_dir=CACHE_DIR,
+        transcoder=None,
     ):
         self._base_url = base_url
         self._dest_dir = os.path.abspath(dest_dir)
@@ -87,14 +98,21 @@ class SSTBulkDownloader:
         self._target_cache_path = os.path.abspath(cache_path)
         self._years = []
         self._targets = None
+        # Optional BackgroundTranscoder fed with each finished download
+        self._transcoder = transcoder
         self.total_bytes = 0
         self.total_files = 0
         self.files_downloaded = 0
         self.files_touched = 0
 
     def run(self, use_cache=True):
-        self._get_targets_info(use_cache)
-        self._dl_targets()
+        try:
+            self._get_targets_info(use_cache)
+            self._dl_targets()
+        finally:
+            if self._transcoder is not None:
+                failed = self._transcoder.close()
+                print(f"Files failed to transcode: {failed}")
         print(f"Files downloaded: {self.files_downloaded}/{self.total_files}")
         print(f"Files touched: {self.files_touched}/{self.total_files}")
         print("Total data: {}".format(_get_size_str(self.total_bytes)))
@@ -106,10 +124,11 @@ class SSTBulkDownloader:
         if use_cache:
             targets = load_cached_data(self._target_cache_path)
             if targets is None:
-                targets = get_data_file_urls(self._base_url)
                 write_cache = False
             else:
                 print("Targets loaded from cache")
+        if targets is None:
+            targets = get_data_file_urls(self._base_url)
         cache_data(targets, self._target_cache_path, force=write_cache)
         self._targets = targets
         self._years = list(self._targets.keys())
@@ -133,11 +152,13 @@ class SSTBulkDownloader:
                 time.sleep(self._time_buffer)
 
     def _dl_target_file(self, dest_dir, target_url, fnum):
+        import requests
+
         f = os.path.basename(target_url)
         dest = os.path.join(dest_dir, f)
         # Assume file names already validated
         date_match = FILE_DATE_RE.match(f)
-        date = pdm.date(*[int(v) for v in date_match.groups()])
+        date = dt.date(*[int(v) for v in date_match.groups()])
         print(f"File {fnum}/{self.total_files}")
         print(date)
         print(f"Downloading: {target_url}")
@@ -145,13 +166,21 @@ class SSTBulkDownloader:
         if os.path.isfile(dest):
             self.files_touched += 1
             print("File already downloaded. Skipping\n")
+            # Catches files left over from an interrupted run. Ones that are
+            # already transcoded are skipped by the transcoder.
+            if self._transcoder is not None:
+                self._transcoder.submit(dest)
             return
         with requests.get(target_url, stream=True) as r:
             try:
+                # Don't save error pages as data files
+                r.raise_for_status()
                 self.total_bytes += _dl_file(r, dest)
                 print("")
                 self.files_downloaded += 1
                 self.files_touched += 1
+                if self._transcoder is not None:
+                    self._transcoder.submit(dest)
             except Exception:
                 # This does not catch KeyboardInterupt
                 print("")
@@ -233,19 +262,54 @@ def _get_parser():
     p.add_argument(
         "-r", "--clear-cache", action="store_true", help="Clear the cache"
     )
+    p.add_argument(
+        "-t",
+        "--transcode",
+        action="store_true",
+        help="Rewrite downloaded files as chunked, packed netCDF4",
+    )
+    p.add_argument(
+        "--transcode-jobs",
+        default=2,
+        type=int,
+        help="Number of background transcoding workers",
+    )
+    p.add_argument(
+        "--complevel",
+        default=DEFAULT_COMPLEVEL,
+        type=int,
+        help="Compression level for transcoded files",
+    )
+    p.add_argument(
+        "--precision",
+        default=DEFAULT_PRECISION,
+        type=float,
+        help="Packing precision for transcoded grids that aren't packed",
+    )
     return p
 
 
-if __name__ == "__main__":
-    args = _get_parser().parse_args()
+def main(args):
     args.data_dir = os.path.abspath(args.data_dir)
     if not os.path.isdir(args.data_dir):
         print(f"Creating data dir: {args.data_dir}")
         os.makedirs(args.data_dir)
+    transcoder = None
+    if args.transcode:
+        transcoder = BackgroundTranscoder(
+            args.transcode_jobs,
+            precision=args.precision,
+            complevel=args.complevel,
+        )
     dloader = SSTBulkDownloader(
         BASE_URL,
         args.data_dir,
         time_buffer=0.001,
         target_cache_dir=args.cache_dir,
+        transcoder=transcoder,
     )
     dloader.run(not args.clear_cache)
+
+
+if __name__ == "__main__":
+    main(_get_parser().parse_args())
@@ -1,9 +1,6 @@
 import argparse
-from dask.diagnostics import ProgressBar
+import calendar
 import os
-import pandas as pd
-import pendulum as pdm
-import xarray as xr
 
 from util import get_year_dirs, LAT_KEY, LON_KEY, SST_KEY, TIME_KEY, xdt_to_dt
 
@@ -13,12 +10,16 @@ _DELIM = ","
 
 def _calc_parallel(task, task_name):
     """Runs a parallel dask operation"""
+    from dask.diagnostics import ProgressBar
+
     print(f"Running: {task_name}")
     with ProgressBar():
         return task.values
 
 
 def extract_and_write_stats(year_dirs, fd, skip):
+    import xarray as xr
+
     for yd in year_dirs:
         yi = int(os.path.basename(yd))
         if yi in skip:
@@ -41,6 +42,21 @@ def extract_and_write_stats(year_dirs, fd, skip):
             _write_line(fd, *values)
 
 
+def extract_file_stats(path):
+    """Returns the (date, min, max, mean) rows for a single data file."""
+    import xarray as xr
+
+    with xr.open_dataset(path) as ds:
+        time = ds[TIME_KEY]
+        sst = ds[SST_KEY]
+        dims = [LAT_KEY, LON_KEY]
+        vdates = [xdt_to_dt(t) for t in time]
+        vmins = sst.min(dim=dims).values
+        vmaxes = sst.max(dim=dims).values
+        vmeans = sst.mean(dim=dims).values
+    return list(zip(vdates, vmins, vmaxes, vmeans))
+
+
 def _write_line(fd, *values):
     # pendulum uses RFC 3339 when printed. I wish everything did... :(
     line = _DELIM.join(["{}".format(v) for v in values]) + "\n"
@@ -50,7 +66,7 @@ def _write_line(fd, *values):
 class _Year:
     def __init__(self, year):
         self.year = year
-        self._total_days = 365 + pdm.date(year, 1, 1).is_leap_year()
+        self._total_days = 365 + calendar.isleap(year)
         self.values = []
 
     def add(self, dt, values):
@@ -65,6 +81,9 @@ class _Year:
 
 def recover_data(fd):
     """Attempts to recover data from `fd`."""
+    import pandas as pd
+    import pendulum as pdm
+
     data = pd.read_csv(fd)
     times = [pdm.parse(dstr) for dstr in data[HEADERS[0]].values]
     vkeys = [k for k in data.columns if k != HEADERS[0]]
@@ -119,9 +138,8 @@ def _get_parser():
 HEADERS = ["#UTC", "min", "max", "mean"]
 
 
-if __name__ == "__main__":
+def main(args):
     # WARNING: This program takes a while
-    args = _get_parser().parse_args()
     year_dirs = get_year_dirs(args.data_dir)
 
     skip_years = frozenset()
@@ -140,3 +158,7 @@ if __name__ == "__main__":
             for values in rec_data:
                 _write_line(fd, *values)
         extract_and_write_stats(year_dirs, fd, skip_years)
+
+
+if __name__ == "__main__":
+    main(_get_parser().parse_args())
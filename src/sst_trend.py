@@ -0,0 +1,353 @@
+"""
+Per grid cell linear SST trend over the whole record.
+
+The regression is never done on the full data set. Instead, running sums
+(n, St, Stt, Sy, Sty, Syy, plus lag-1 cross products for the residual
+autocorrelation) are kept for every cell while walking the data files.
+Partial sums from different stretches of time can simply be added
+together, so the files are split up and reduced in parallel.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import math
+import numpy as np
+import os
+import xarray as xr
+
+from pipeline import get_year_files
+from util import LAT_KEY, LON_KEY, SST_KEY, TIME_KEY
+
+
+# Time is measured in decades since this date so that slopes are per decade
+# and the sums stay well conditioned.
+EPOCH = np.datetime64("1988-01-01T00:00:00", "s")
+_SECONDS_PER_DECADE = 10 * 365.2425 * 24 * 60 * 60
+
+_SUMS = ["n", "st", "stt", "sy", "sty", "syy"]
+# Sums over pairs of consecutive time steps, where l marks the earlier
+# (lagged) sample. Used for the lag-1 autocorrelation of the residuals.
+_PAIR_SUMS = ["m", "py", "pyl", "pt", "ptl", "pyyl", "ptyl", "ptly", "pttl"]
+# First and last time steps seen, needed to pair up samples across merges
+_EDGES = ["first_t", "first_y", "last_t", "last_y"]
+
+
+def to_decades(times):
+    """Converts an array of np.datetime64 to decades since `EPOCH`."""
+    delta = (times.astype("datetime64[s]") - EPOCH).astype(float)
+    return delta / _SECONDS_PER_DECADE
+
+
+class TrendAccumulator:
+    """Running least-squares sums for every cell of a lat/lon grid.
+
+    Samples must be added in time order. Accumulators built over
+    consecutive stretches of time can be merged in either order.
+    """
+
+    def __init__(self, lat, lon):
+        self.lat = np.asarray(lat)
+        self.lon = np.asarray(lon)
+        shape = (len(self.lat), len(self.lon))
+        for k in _SUMS + _PAIR_SUMS:
+            setattr(self, k, np.zeros(shape))
+        self.n = self.n.astype(np.int64)
+        self.m = self.m.astype(np.int64)
+        self.first_t = np.nan
+        self.last_t = np.nan
+        self.first_y = np.full(shape, np.nan)
+        self.last_y = np.full(shape, np.nan)
+
+    def _add_pairs(self, t, tl, y, yl):
+        valid = ~(np.isnan(y) | np.isnan(yl))
+        y = np.where(valid, y, 0.0)
+        yl = np.where(valid, yl, 0.0)
+        t = np.where(valid, t, 0.0)
+        tl = np.where(valid, tl, 0.0)
+        self.m += valid.sum(axis=0)
+        self.py += y.sum(axis=0)
+        self.pyl += yl.sum(axis=0)
+        self.pt += t.sum(axis=0)
+        self.ptl += tl.sum(axis=0)
+        self.pyyl += (y * yl).sum(axis=0)
+        self.ptyl += (t * yl).sum(axis=0)
+        self.ptly += (tl * y).sum(axis=0)
+        self.pttl += (t * tl).sum(axis=0)
+
+    def add(self, t, y):
+        """Adds samples to the sums.
+
+        `t` is a 1D array of times in decades and `y` a (time, lat, lon)
+        array. NaN values in `y` are skipped.
+        """
+        y = np.asarray(y, dtype=float)
+        t = np.asarray(t, dtype=float)
+        if len(t) == 0:
+            return
+        # The lag-1 sums pair each sample with the one before it
+        if np.any(np.diff(t) <= 0) or t[0] <= self.last_t:
+            raise ValueError("Samples must be added in increasing time order")
+        if np.isnan(self.first_t):
+            self.first_t = t[0]
+            self.first_y = y[0].copy()
+        else:
+            t = np.concatenate([[self.last_t], t])
+            y = np.concatenate([self.last_y[None], y])
+        tb = t[:, None, None]
+        self._add_pairs(tb[1:], tb[:-1], y[1:], y[:-1])
+        if not np.isnan(self.last_t):
+            # Drop the carried over sample before adding the plain sums
+            t = t[1:]
+            y = y[1:]
+            tb = tb[1:]
+        self.last_t = t[-1]
+        self.last_y = y[-1].copy()
+        valid = ~np.isnan(y)
+        yv = np.where(valid, y, 0.0)
+        tv = np.where(valid, tb, 0.0)
+        self.n += valid.sum(axis=0)
+        self.st += tv.sum(axis=0)
+        self.stt += (tv * tv).sum(axis=0)
+        self.sy += yv.sum(axis=0)
+        self.sty += (tv * yv).sum(axis=0)
+        self.syy += (yv * yv).sum(axis=0)
+
+    def merge(self, other):
+        """Adds the sums from `other` into this accumulator."""
+        if self.n.shape != other.n.shape:
+            raise ValueError("Cannot merge accumulators with different grids")
+        if np.isnan(other.first_t):
+            return self
+        if np.isnan(self.first_t):
+            early, late = other, other
+        elif self.last_t < other.first_t:
+            early, late = self, other
+        elif other.last_t < self.first_t:
+            early, late = other, self
+        else:
+            raise ValueError("Cannot merge overlapping time ranges")
+        for k in _SUMS + _PAIR_SUMS:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        if early is not late:
+            self._add_pairs(
+                late.first_t,
+                early.last_t,
+                late.first_y[None],
+                early.last_y[None],
+            )
+        self.first_t, self.first_y = early.first_t, early.first_y
+        self.last_t, self.last_y = late.last_t, late.last_y
+        return self
+
+    def save(self, path):
+        sums = {k: getattr(self, k) for k in _SUMS + _PAIR_SUMS + _EDGES}
+        with open(path, "wb") as fd:
+            np.savez(fd, lat=self.lat, lon=self.lon, **sums)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            acc = cls(data["lat"], data["lon"])
+            for k in _SUMS + _PAIR_SUMS:
+                setattr(acc, k, data[k])
+            for k in _EDGES:
+                v = data[k]
+                setattr(acc, k, v.item() if v.ndim == 0 else v)
+        return acc
+
+    def fit(self):
+        """Returns an xarray Dataset with the fitted trend grids.
+
+        The data still contain the diurnal and seasonal cycles, so the
+        residuals are strongly autocorrelated. The standard error, t
+        statistic and p-value use an effective sample size
+        n (1 - r1) / (1 + r1), where r1 is the lag-1 autocorrelation of the
+        residuals, and a Student t distribution with n_eff - 2 degrees of
+        freedom.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            n = self.n.astype(float)
+            sxx = self.stt - self.st * self.st / n
+            sxy = self.sty - self.st * self.sy / n
+            syy = self.syy - self.sy * self.sy / n
+            slope = sxy / sxx
+            intercept = (self.sy - slope * self.st) / n
+            sse = np.maximum(syy - slope * sxy, 0.0)
+            r1 = self._residual_lag1(intercept, slope) / (sse / n)
+            r1 = np.clip(r1, 0.0, 1.0)
+            n_eff = n * (1 - r1) / (1 + r1)
+            stderr = np.sqrt(sse / (n_eff - 2) / sxx)
+            tstat = slope / stderr
+        undefined = (self.n < 3) | ~(sxx > 0)
+        for a in (slope, intercept, r1, n_eff):
+            a[undefined] = np.nan
+        undefined |= ~(n_eff > 2)
+        for a in (stderr, tstat):
+            a[undefined] = np.nan
+        pvalue = _two_sided_p(tstat, n_eff - 2)
+        coords = {LAT_KEY: self.lat, LON_KEY: self.lon}
+        dims = [LAT_KEY, LON_KEY]
+        epoch = str(EPOCH)
+        return xr.Dataset(
+            {
+                "slope": (dims, slope, {"units": "degC/decade"}),
+                "intercept": (
+                    dims,
+                    intercept,
+                    {"units": "degC", "long_name": f"Fit value at {epoch}"},
+                ),
+                "slope_stderr": (dims, stderr, {"units": "degC/decade"}),
+                "t_stat": (dims, tstat),
+                "p_value": (dims, pvalue),
+                "lag1_autocorr": (dims, r1),
+                "n_eff": (dims, n_eff),
+                "n": (dims, self.n),
+            },
+            coords=coords,
+            attrs={"epoch": epoch},
+        )
+
+    def _residual_lag1(self, a, b):
+        """Mean product of consecutive residuals y - a - b t."""
+        s = (
+            self.pyyl
+            - a * (self.py + self.pyl)
+            - b * (self.ptly + self.ptyl)
+            + a * a * self.m
+            + a * b * (self.pt + self.ptl)
+            + b * b * self.pttl
+        )
+        return s / self.m
+
+
+_CF_ITERS = 300
+_CF_EPS = 1e-14
+_CF_TINY = 1e-300
+
+
+def _betacf(a, b, x):
+    # Continued fraction for the incomplete beta function (modified Lentz)
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > _CF_TINY else _CF_TINY)
+    h = d
+    for m in range(1, _CF_ITERS + 1):
+        m2 = 2 * m
+        for aa in (
+            m * (b - m) * x / ((qam + m2) * (a + m2)),
+            -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2)),
+        ):
+            d = 1.0 + aa * d
+            d = 1.0 / (d if abs(d) > _CF_TINY else _CF_TINY)
+            c = 1.0 + aa / c
+            c = c if abs(c) > _CF_TINY else _CF_TINY
+            h *= d * c
+        if abs(d * c - 1.0) < _CF_EPS:
+            break
+    return h
+
+
+def _betai(a, b, x):
+    """Regularized incomplete beta function I_x(a, b)."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    ln_front = (
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log1p(-x)
+    )
+    front = math.exp(ln_front)
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def _t_sf2(t, df):
+    return _betai(df / 2.0, 0.5, df / (df + t * t))
+
+
+_t_sf2_vec = np.frompyfunc(_t_sf2, 2, 1)
+
+
+def _two_sided_p(tstat, df):
+    """Two-sided p-values of Student t statistics."""
+    p = np.full(tstat.shape, np.nan)
+    valid = ~(np.isnan(tstat) | np.isnan(df))
+    p[valid] = _t_sf2_vec(tstat[valid], df[valid]).astype(float)
+    return p
+
+
+def accumulate_files(files):
+    """Builds an accumulator from `files`, read in the order given."""
+    acc = None
+    for f in files:
+        with xr.open_dataset(f) as ds:
+            sst = ds[SST_KEY].transpose(TIME_KEY, LAT_KEY, LON_KEY)
+            if acc is None:
+                acc = TrendAccumulator(ds[LAT_KEY].values, ds[LON_KEY].values)
+            acc.add(to_decades(ds[TIME_KEY].values), sst.values)
+    return acc
+
+
+def _split(items, nchunks):
+    size = max(1, math.ceil(len(items) / nchunks))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def accumulate_parallel(files, njobs=1):
+    """Accumulates `files` across a process pool and merges the partials."""
+    # More chunks than workers keeps the pool busy when file sizes differ
+    chunks = _split(files, njobs * 4)
+    total = None
+    with ProcessPoolExecutor(njobs) as pool:
+        for i, acc in enumerate(pool.map(accumulate_files, chunks)):
+            print(f"Accumulated chunk {i + 1}/{len(chunks)}")
+            if acc is None:
+                continue
+            total = acc if total is None else total.merge(acc)
+    return total
+
+
+def write_trend(acc, out_file):
+    ds = acc.fit()
+    tmp = out_file + ".tmp"
+    ds.to_netcdf(tmp)
+    os.replace(tmp, out_file)
+
+
+def _validate_data_dir(d):
+    path = os.path.abspath(d)
+    if not os.path.isdir(path):
+        raise ValueError("Invalid data dir")
+    return path
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-d", "--data-dir", type=_validate_data_dir, help="Root data directory"
+    )
+    p.add_argument(
+        "-o", "--out-file", type=os.path.abspath, help="Output netCDF file"
+    )
+    p.add_argument(
+        "-j", "--jobs", default=os.cpu_count(), type=int, help="Worker count"
+    )
+    return p
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    files = [f for _, fs in get_year_files(args.data_dir) for f in fs]
+    print(f"Found {len(files)} data files")
+    acc = accumulate_parallel(files, args.jobs)
+    if acc is None:
+        raise SystemExit("No data found")
+    write_trend(acc, args.out_file)
+    print(f"Trend written to {args.out_file}")
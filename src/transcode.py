@@ -0,0 +1,216 @@
+"""
+Rewrites data files as chunked, compressed netCDF4 with float grids packed
+into int16 scale/offset form.
+
+Every later step reads the data files many times, so paying for a rewrite
+once on ingest makes all of those reads smaller and cheaper. The checksum
+of the original file is kept in the global attributes for provenance.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import traceback
+
+from util import LAT_KEY, LON_KEY, TIME_KEY
+
+
+CHECKSUM_ATTR = "source_sha256"
+SIZE_ATTR = "source_size"
+# Used when the source grid isn't already packed
+DEFAULT_PRECISION = 0.01
+DEFAULT_COMPLEVEL = 4
+
+_INT16_FILL = -32768
+# Largest packed magnitude, keeping the fill value out of range
+_INT16_MAX = 32767
+_HASH_CHUNK = 4 * 1024 * 1024
+
+
+def file_checksum(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(_HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_transcoded(path):
+    import xarray as xr
+
+    with xr.open_dataset(path, decode_times=False) as ds:
+        return CHECKSUM_ATTR in ds.attrs
+
+
+def _chunk_sizes(var):
+    # Every reader walks the data one time step at a time over the whole
+    # grid, so chunk along time only.
+    return [1 if d == TIME_KEY else var.sizes[d] for d in var.dims]
+
+
+def _packing(var, precision):
+    """Returns (scale, offset) for packing `var` into int16 or None if the
+    values don't fit at the given precision."""
+    import numpy as np
+
+    scale = var.encoding.get("scale_factor", precision)
+    vmin = float(var.min(skipna=True))
+    vmax = float(var.max(skipna=True))
+    if np.isnan(vmin):
+        return None
+    offset = var.encoding.get("add_offset")
+    if offset is None:
+        offset = round((vmin + vmax) / 2 / scale) * scale
+    if max(abs(vmax - offset), abs(vmin - offset)) / scale > _INT16_MAX:
+        return None
+    return scale, offset
+
+
+def _get_encoding(ds, precision, complevel):
+    import numpy as np
+
+    encoding = {}
+    for k, var in ds.data_vars.items():
+        enc = {"zlib": complevel > 0, "complevel": complevel, "shuffle": True}
+        is_grid = LAT_KEY in var.dims and LON_KEY in var.dims
+        if is_grid:
+            enc["chunksizes"] = _chunk_sizes(var)
+        packing = None
+        if is_grid and np.issubdtype(var.dtype, np.floating):
+            packing = _packing(var, precision)
+        if packing is not None:
+            enc.update(
+                dtype="int16",
+                scale_factor=packing[0],
+                add_offset=packing[1],
+                _FillValue=np.int16(_INT16_FILL),
+            )
+        elif "scale_factor" in var.encoding or "add_offset" in var.encoding:
+            # Values are already decoded to floats. Keep the source packing
+            # so they aren't written back as bare, truncated integers.
+            for key in ["dtype", "scale_factor", "add_offset", "_FillValue"]:
+                if key in var.encoding:
+                    enc[key] = var.encoding[key]
+        elif "_FillValue" in var.encoding:
+            enc["_FillValue"] = var.encoding["_FillValue"]
+        if "dtype" not in enc and "dtype" in var.encoding:
+            enc["dtype"] = var.encoding["dtype"]
+        encoding[k] = enc
+    return encoding
+
+
+def transcode_file(
+    path, precision=DEFAULT_PRECISION, complevel=DEFAULT_COMPLEVEL
+):
+    """Rewrites `path` in place. Returns False if it was already done."""
+    import xarray as xr
+
+    if is_transcoded(path):
+        return False
+    checksum = file_checksum(path)
+    size = os.path.getsize(path)
+    tmp = path + "_transcode"
+    try:
+        with xr.open_dataset(path) as ds:
+            ds.load()
+            ds.attrs[CHECKSUM_ATTR] = checksum
+            ds.attrs[SIZE_ATTR] = size
+            encoding = _get_encoding(ds, precision, complevel)
+            ds.to_netcdf(
+                tmp, format="NETCDF4", engine="netcdf4", encoding=encoding
+            )
+        os.replace(tmp, path)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+    return True
+
+
+def _transcode_job(path, precision, complevel):
+    try:
+        done = transcode_file(path, precision, complevel)
+    except Exception:
+        print(f"Failed to transcode: {path}")
+        traceback.print_exc()
+        return False
+    if done:
+        print(f"Transcoded: {path}")
+    return True
+
+
+class BackgroundTranscoder:
+    """Transcodes files in a pool of worker processes.
+
+    Files are submitted as they arrive and the caller only waits on
+    `close`, so transcoding overlaps with other work such as downloading.
+    """
+
+    def __init__(
+        self,
+        njobs=1,
+        precision=DEFAULT_PRECISION,
+        complevel=DEFAULT_COMPLEVEL,
+    ):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self._pool = ProcessPoolExecutor(njobs)
+        self._precision = precision
+        self._complevel = complevel
+        self._futures = []
+
+    def submit(self, path):
+        fut = self._pool.submit(
+            _transcode_job, path, self._precision, self._complevel
+        )
+        self._futures.append(fut)
+
+    def close(self):
+        """Waits for all submitted files. Returns the number that failed."""
+        print("Waiting for transcoding to finish")
+        self._pool.shutdown(wait=True)
+        failed = sum(not f.result() for f in self._futures)
+        self._futures = []
+        return failed
+
+
+def _validate_data_dir(d):
+    path = os.path.abspath(d)
+    if not os.path.isdir(path):
+        raise ValueError("Invalid data dir")
+    return path
+
+
+def _get_parser():
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-d", "--data-dir", type=_validate_data_dir, help="Root data directory"
+    )
+    p.add_argument(
+        "-j", "--jobs", default=os.cpu_count(), type=int, help="Worker count"
+    )
+    p.add_argument(
+        "-p",
+        "--precision",
+        default=DEFAULT_PRECISION,
+        type=float,
+        help="Packing precision for grids that aren't already packed",
+    )
+    p.add_argument(
+        "-l",
+        "--complevel",
+        default=DEFAULT_COMPLEVEL,
+        type=int,
+        help="zlib compression level (0-9)",
+    )
+    return p
+
+
+if __name__ == "__main__":
+    args = _get_parser().parse_args()
+    files = sorted(glob.glob(os.path.join(args.data_dir, "*", "*.nc")))
+    print(f"Found {len(files)} data files")
+    tc = BackgroundTranscoder(args.jobs, args.precision, args.complevel)
+    for f in files:
+        tc.submit(f)
+    failed = tc.close()
+    print(f"Failed: {failed}/{len(files)}")
@@ -1,10 +1,9 @@
 import argparse
 import glob
 import os
-import pendulum as pdm
 import pickle
 import re
-from sys import stdout
+import sys
 
 
 _YEAR_DIR_RE = re.compile(".*/\\d{4}$")
@@ -57,6 +56,8 @@ def xdt_to_dt(xdt):
     np.datetime64 objects are nice but difficult to work with so convert them
     to pendulum datetimes.
     """
+    import pendulum as pdm
+
     return pdm.from_timestamp(xextr(xdt) * _NS, "UTC")
 
 
@@ -96,12 +97,12 @@ class ProgressIndicator:
         if self._mode == "BAR":
             progress = self._get_progress()
             nticks = int(progress * self._width)
-            stdout.write(self._fmt.format(self._fill * nticks, progress))
+            sys.stdout.write(self._fmt.format(self._fill * nticks, progress))
         else:
             # Overwrite last print
-            stdout.write("\r{:100}".format(" "))
-            stdout.write("\r{} {}".format(value, self._unit))
-        stdout.flush()
+            sys.stdout.write("\r{:100}".format(" "))
+            sys.stdout.write("\r{} {}".format(value, self._unit))
+        sys.stdout.flush()
 
     def done(self):
         print("")
@@ -136,6 +137,14 @@ def load_cached_data(data_path):
         return pickle.load(fd)
 
 
+def init_plotting():
+    import seaborn as sns
+
+    sns.set()
+    sns.set_style("white")
+    sns.set_style("ticks")
+
+
 def get_data_dir_arg_parser():
     p = argparse.ArgumentParser()
     p.add_argument(